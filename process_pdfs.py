@@ -1,4 +1,5 @@
 import fitz  # PyMuPDF
+import numpy as np
 import os
 import json
 import sys
@@ -6,172 +7,230 @@ import re
 import unicodedata
 from pathlib import Path
 from collections import Counter
-from statistics import median
+from concurrent.futures import ProcessPoolExecutor
+try:
+    import orjson
+except ImportError:  # Fall back to the standard library serializer
+    orjson = None
 
 # Define input and output directories as per Docker requirements
 INPUT_DIR = Path("/app/input")
 OUTPUT_DIR = Path("/app/output")
 
-def extract_text_details(pdf_path):
+# Text-only extraction: images are never materialized in the page dict
+TEXT_FLAGS = fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES
+
+_SEP_CHARS = frozenset('-=~|*#+')
+_NUM_RE = re.compile(r'^\d+(\.\d+)*(\.\s|\s|$)')
+
+def iter_page_lines(blocks, top_cut, bot_cut):
     """
-    Extracts text information from a PDF, filtering noise and capturing layout details.
+    Yields the text lines of a page that survive the noise and header/footer filters as
+    (text, span_sizes, line_flags, bbox, block_density) tuples.
+    """
+    for block in blocks:
+        block_density = len(block["lines"])  # Indicates if part of dense text block
+        for line in block["lines"]:
+            line_text = ""
+            line_sizes = []
+            line_flags = 0  # Union of the span font flags
+            min_x0 = float('inf')
+            max_x1 = float('-inf')
+            min_y0 = float('inf')
+            max_y1 = float('-inf')
+
+            for span in line["spans"]:
+                text = span["text"].strip()
+                if not text:
+                    continue
+                if not text.isascii():  # NFKC is a no-op on ASCII
+                    text = unicodedata.normalize("NFKC", text)
+                # Skip separators or non-semantic text
+                if len(text) < 2 or _SEP_CHARS.issuperset(text):
+                    continue
+                line_text += text + " "
+                line_sizes.append(round(span["size"], 2))
+                line_flags |= span["flags"]
+                min_x0 = min(min_x0, span["bbox"][0])
+                max_x1 = max(max_x1, span["bbox"][2])
+                min_y0 = min(min_y0, span["bbox"][1])
+                max_y1 = max(max_y1, span["bbox"][3])
+
+            line_text = line_text.strip()
+            if not line_text or len(line_text) < 3 or not has_min_alnum(line_text, 2):
+                continue
+            # Filter headers/footers
+            if min_y0 < top_cut or max_y1 > bot_cut:
+                continue
+
+            yield line_text, line_sizes, line_flags, (min_x0, min_y0, max_x1, max_y1), block_density
+
+def font_size_profile(font_sizes):
+    """
+    Returns the span sizes above 6pt as an array together with the body text size,
+    which is None when there are no such sizes.
+    """
+    sizes = np.asarray(font_sizes, dtype=np.float64)
+    sizes = sizes[sizes > 6]
+    if not sizes.size:
+        return sizes, None
+
+    body_text_size = float(np.median(sizes))  # Use median for robustness
+    size_counts = Counter([round(s, 1) for s in sizes.tolist()]).most_common(1)
+    body_text_size = max(body_text_size, size_counts[0][0])  # Prefer most common if close
+    return sizes, body_text_size
+
+def extract_text_details(doc):
+    """
+    Extracts text information from an open PDF, filtering noise and capturing layout details.
+    Returns the lines, the font size profile (see font_size_profile) of their spans, the
+    document metadata and first page height. The profile is None when no line survives.
+
+    Each page is extracted once. Font sizes are profiled over every kept line to find the
+    body text size, and only the title page lines and the lines large enough to ever be
+    assigned a heading level are stored.
     """
     document_lines = []
+    font_sizes = []
+    pending = []  # Compact records of lines that may be stored once the body size is known
     try:
-        doc = fitz.open(pdf_path)
+        metadata = doc.metadata
+        page0_height = doc.load_page(0).mediabox.height
         for page_num in range(doc.page_count):
             page = doc.load_page(page_num)
-            blocks = page.get_text("dict")["blocks"]
             page_height = page.mediabox.height
             page_width = page.mediabox.width
-            current_page_lines = []
+            top_cut = 0.1 * page_height
+            bot_cut = 0.9 * page_height
+            inv_pw = 1.0 / page_width
+            # No clip rect: clipping changes MuPDF's block grouping and so block_density
+            blocks = page.get_textpage(flags=TEXT_FLAGS).extractDICT()["blocks"]
             prev_y1 = None
 
-            for block in blocks:
-                if block["type"] != 0:  # Skip non-text blocks
+            for line_text, line_sizes, line_flags, bbox, block_density in iter_page_lines(blocks, top_cut, bot_cut):
+                font_sizes.extend(line_sizes)
+                min_x0, min_y0, max_x1, max_y1 = bbox
+                spacing_above = (min_y0 - prev_y1) if prev_y1 is not None else 0
+                prev_y1 = max_y1
+                # Dense blocks never yield headings; past the title page only their sizes and extent are kept
+                if block_density > 5 and page_num > 0:
                     continue
-                for line in block["lines"]:
-                    line_text = ""
-                    line_spans_details = []
-                    min_x0 = float('inf')
-                    max_x1 = float('-inf')
-                    min_y0 = float('inf')
-                    max_y1 = float('-inf')
-
-                    for span in line["spans"]:
-                        text = span["text"].strip()
-                        if not text:
-                            continue
-                        text = unicodedata.normalize("NFKC", text)
-                        # Skip separators or non-semantic text
-                        if re.match(r'^[-=~|*#+]{2,}$', text) or len(text) < 2:
-                            continue
-                        line_text += text + " "
-                        line_spans_details.append({
-                            "text": text,
-                            "font": span["font"],
-                            "size": round(span["size"], 2),
-                            "flags": span["flags"],
-                            "bbox": span["bbox"]
-                        })
-                        min_x0 = min(min_x0, span["bbox"][0])
-                        max_x1 = max(max_x1, span["bbox"][2])
-                        min_y0 = min(min_y0, span["bbox"][1])
-                        max_y1 = max(max_y1, span["bbox"][3])
-
-                    line_text = line_text.strip()
-                    if not line_text or len(line_text) < 3 or sum(c.isalnum() for c in line_text) < 2:
-                        continue
-                    # Filter headers/footers
-                    if min_y0 < 0.1 * page_height or max_y1 > 0.9 * page_height:
-                        continue
-
-                    spacing_above = (min_y0 - prev_y1) if prev_y1 is not None else 0
-                    prev_y1 = max_y1
-
-                    current_page_lines.append({
-                        "text": line_text,
-                        "page": page_num + 1,
-                        "bbox": (min_x0, min_y0, max_x1, max_y1),
-                        "spans": line_spans_details,
-                        "is_centered": abs(min_x0 + max_x1 - page_width) / page_width < 0.25,
-                        "spacing_above": spacing_above,
-                        "block_density": len(block["lines"])  # Indicates if part of dense text block
-                    })
-            document_lines.extend(current_page_lines)
-        doc.close()
-        return document_lines
+
+                pending.append((
+                    page_num, line_text, sum(line_sizes) / len(line_sizes), line_flags, bbox,
+                    abs(min_x0 + max_x1 - page_width) * inv_pw < 0.25, spacing_above, block_density
+                ))
+
+        if not font_sizes:
+            return [], None, metadata, page0_height
+        profile = font_size_profile(font_sizes)
+        body_text_size = profile[1]
+        # Every heading level needs at least 0.95x a heading size, and heading sizes exceed 1.2x body
+        min_heading_size = body_text_size * 1.2 * 0.95 if body_text_size is not None else float('inf')
+
+        for page_num, line_text, avg_size, line_flags, bbox, is_centered, spacing_above, block_density in pending:
+            # Title detection needs all of page 1; elsewhere small lines never become headings
+            if page_num > 0 and avg_size < min_heading_size:
+                continue
+            document_lines.append({
+                "text": line_text,
+                "text_key": sys.intern(line_text.lower()),  # De-duplication key
+                "page": page_num + 1,
+                "bbox": bbox,
+                "avg_size": avg_size,
+                "is_any_bold": is_bold(line_flags),
+                "is_centered": is_centered,
+                "spacing_above": spacing_above,
+                "block_density": block_density
+            })
+        return document_lines, profile, metadata, page0_height
     except Exception as e:
-        print(f"Error processing {pdf_path} during text extraction: {e}", file=sys.stderr)
-        return []
+        print(f"Error processing {doc.name} during text extraction: {e}", file=sys.stderr)
+        return [], None, {}, 0
 
 def is_bold(flags):
     """Checks if the font flags indicate bold text."""
     return (flags & 4) != 0
 
+def has_min_alnum(text, k):
+    """Checks if text has at least k alphanumeric characters, stopping as soon as it does."""
+    count = 0
+    for c in text:
+        if c.isalnum():
+            count += 1
+            if count >= k:
+                return True
+    return False
+
 def is_heading_numbered(text):
     """Checks if text starts with a numbering pattern (e.g., '1.', '1.1')."""
-    return bool(re.match(r'^\d+(\.\d+)*(\.\s|\s|$)', text))
-
-def compute_heading_score(line, heading_size_map, body_text_size):
-    """Computes a score to determine if a line is a heading."""
-    avg_size = sum(span["size"] for span in line["spans"]) / len(line["spans"]) if line["spans"] else 0
-    is_any_bold = any(is_bold(span["flags"]) for span in line["spans"])
-    is_numbered = is_heading_numbered(line["text"])
-    is_short = len(line["text"]) < 80
-    is_centered = line["is_centered"]
-    spacing_above = line["spacing_above"] if line["spacing_above"] > 0 else 0
-    is_sparse = line["block_density"] <= 3  # Headings often in small blocks
-
-    score = 0
-    if avg_size > body_text_size * 1.2:
-        score += 40
-    if is_any_bold:
-        score += 25
-    if is_numbered:
-        score += 25
-    if is_short:
-        score += 20
-    if is_centered:
-        score += 15
-    if spacing_above > avg_size * 2:
-        score += 20
-    if is_sparse:
-        score += 15
-
+    return _NUM_RE.match(text) is not None
+
+def build_line_features(lines):
+    """Builds columnar NumPy arrays of the per-line features used for heading scoring."""
+    n = len(lines)
+    return {
+        "avg_size": np.fromiter((line["avg_size"] for line in lines), dtype=np.float64, count=n),
+        "is_bold": np.fromiter((line["is_any_bold"] for line in lines), dtype=np.bool_, count=n),
+        "is_numbered": np.fromiter((is_heading_numbered(line["text"]) for line in lines), dtype=np.bool_, count=n),
+        "is_short": np.fromiter((len(line["text"]) < 80 for line in lines), dtype=np.bool_, count=n),
+        "is_centered": np.fromiter((line["is_centered"] for line in lines), dtype=np.bool_, count=n),
+        "spacing_above": np.fromiter((max(line["spacing_above"], 0) for line in lines), dtype=np.float64, count=n),
+        "block_density": np.fromiter((line["block_density"] for line in lines), dtype=np.int32, count=n),
+        "page": np.fromiter((line["page"] for line in lines), dtype=np.int32, count=n),
+        "y0": np.fromiter((line["bbox"][1] for line in lines), dtype=np.float64, count=n),
+        "text": np.array([line["text"] for line in lines], dtype=object),
+        "text_key": np.array([line["text_key"] for line in lines], dtype=object),
+    }
+
+def _score_kernel(avg, bold, numbered, short, centered, spacing, sparse, body, h1_th, h2_th, h3_th):
+    """
+    Computes the heading score of every line from plain numeric feature arrays.
+    The hN_th thresholds are 0.95x the heading sizes, infinite for missing levels.
+    """
+    score = (
+        40 * (avg > body * 1.2)
+        + 25 * bold
+        + 25 * numbered
+        + 20 * short
+        + 15 * centered
+        + 20 * (spacing > avg * 2)
+        + 15 * sparse
+    )
     # Bonus for matching heading sizes
-    if "H1" in heading_size_map and avg_size >= heading_size_map["H1"] * 0.95:
-        score += 25
-    elif "H2" in heading_size_map and avg_size >= heading_size_map["H2"] * 0.95:
-        score += 20
-    elif "H3" in heading_size_map and avg_size >= heading_size_map["H3"] * 0.95:
-        score += 15
-
-    return score
+    score += np.select([avg >= h1_th, avg >= h2_th, avg >= h3_th], [25, 20, 15], default=0)
+    return score.astype(np.int16)
 
-def identify_headings(lines, pdf_path):
+def identify_headings(lines, profile, metadata, page0_height):
     """
     Identifies title, H1, H2, and H3 headings using refined heuristics.
     """
-    if not lines:
+    if profile is None:
         return {"title": "No Title Found", "outline": []}
 
     # Get metadata title
     title = "No Title Found"
-    try:
-        doc = fitz.open(pdf_path)
-        metadata = doc.metadata
-        if metadata.get("title") and metadata["title"].strip() and sum(c.isalnum() for c in metadata["title"]) >= 3:
-            title = unicodedata.normalize("NFKC", metadata["title"].strip())
-        doc.close()
-    except Exception:
-        pass
-
-    # Determine body text font size
-    all_font_sizes = [span["size"] for line in lines for span in line["spans"] if span["size"] > 6]
-    if not all_font_sizes:
-        return {"title": title, "outline": []}
+    if metadata and metadata.get("title") and metadata["title"].strip() and has_min_alnum(metadata["title"], 3):
+        title = unicodedata.normalize("NFKC", metadata["title"].strip())
 
-    body_text_size = median(all_font_sizes)  # Use median for robustness
-    size_counts = Counter([round(s, 1) for s in all_font_sizes]).most_common()
-    if size_counts:
-        body_text_size = max(body_text_size, size_counts[0][0])  # Prefer most common if close
+    # Body text font size, profiled during extraction
+    sizes, body_text_size = profile
+    if body_text_size is None:
+        return {"title": title, "outline": []}
 
     # Identify heading sizes
-    potential_heading_sizes = sorted(
-        list(set([s for s in all_font_sizes if s > body_text_size * 1.2])),
-        reverse=True
-    )
+    potential_heading_sizes = np.unique(sizes[sizes > body_text_size * 1.2])[::-1].tolist()
 
     heading_size_map = {}
     if potential_heading_sizes:
         heading_size_map["H1"] = potential_heading_sizes[0]
-    if len(potential_heading_sizes) >= 2 and potential_heading_sizes[1] < potential_heading_sizes[0] * 0.95:
-        heading_size_map["H2"] = potential_heading_sizes[1]
-    if len(potential_heading_sizes) >= 3 and potential_heading_sizes[2] < potential_heading_sizes[0] * 0.95:
-        heading_size_map["H3"] = potential_heading_sizes[2]
-    if len(potential_heading_sizes) >= 4 and potential_heading_sizes[3] < potential_heading_sizes[0] * 0.95:
-        heading_size_map["H4"] = potential_heading_sizes[3]
+        top_th = potential_heading_sizes[0] * 0.95
+        if len(potential_heading_sizes) >= 2 and potential_heading_sizes[1] < top_th:
+            heading_size_map["H2"] = potential_heading_sizes[1]
+        if len(potential_heading_sizes) >= 3 and potential_heading_sizes[2] < top_th:
+            heading_size_map["H3"] = potential_heading_sizes[2]
+        if len(potential_heading_sizes) >= 4 and potential_heading_sizes[3] < top_th:
+            heading_size_map["H4"] = potential_heading_sizes[3]
 
 
     # Title detection
@@ -185,7 +244,7 @@ def identify_headings(lines, pdf_path):
     prev_y1 = None
 
     for line in first_page_lines:
-        avg_size = sum(span["size"] for span in line["spans"]) / len(line["spans"]) if line["spans"] else 0
+        avg_size = line["avg_size"]
         if prev_size is None or (
             prev_y1 is not None and
             line["bbox"][1] - prev_y1 < avg_size * 1.5 and
@@ -205,20 +264,17 @@ def identify_headings(lines, pdf_path):
     best_title_text = title
     for candidate in title_candidates:
         text = " ".join(line["text"] for line in candidate)
-        if sum(c.isalnum() for c in text) < 3 or len(text) < 5:
+        if not has_min_alnum(text, 3) or len(text) < 5:
             continue
-        avg_size = sum(
-            sum(span["size"] for span in line["spans"]) / len(line["spans"])
-            for line in candidate
-        ) / len(candidate)
+        avg_size = sum(line["avg_size"] for line in candidate) / len(candidate)
         score = 0
         if avg_size > body_text_size * 1.3:
             score += 40
         if any(line["is_centered"] for line in candidate):
             score += 25
-        if any(any(is_bold(span["flags"]) for span in line["spans"]) for line in candidate):
+        if any(line["is_any_bold"] for line in candidate):
             score += 25
-        if candidate[0]["bbox"][1] < 0.25 * fitz.open(pdf_path).load_page(0).mediabox.height:
+        if candidate[0]["bbox"][1] < 0.25 * page0_height:
             score += 30
         if len(candidate) == 1 or (len(candidate) > 1 and all(line["block_density"] <= 3 for line in candidate)):
             score += 20
@@ -234,47 +290,46 @@ def identify_headings(lines, pdf_path):
     seen_headings = set()
     headings_per_page = Counter()
 
-    for line in lines:
-        text = line["text"]
-        page = line["page"]
-        if sum(c.isalnum() for c in text) < 2 or len(text) < 3:
-            continue
-        if headings_per_page[page] > 8:  # Limit headings per page
-            continue
-        if line["block_density"] > 5:  # Skip dense text blocks
-            continue
+    features = build_line_features(lines)
+    avg_size = features["avg_size"]
+    h1_th = heading_size_map.get("H1", float('inf')) * 0.95
+    h2_th = heading_size_map.get("H2", float('inf')) * 0.95
+    h3_th = heading_size_map.get("H3", float('inf')) * 0.95
+    score = _score_kernel(
+        avg_size,
+        features["is_bold"],
+        features["is_numbered"],
+        features["is_short"],
+        features["is_centered"],
+        features["spacing_above"],
+        features["block_density"] <= 3,  # Headings often in small blocks
+        body_text_size, h1_th, h2_th, h3_th
+    )
+    at_h1 = avg_size >= h1_th
+    at_h2 = avg_size >= h2_th
+    levels = np.select(
+        [
+            at_h1 & (score >= 100),
+            at_h2 & ~at_h1 & (score >= 90),
+            (avg_size >= h3_th) & ~at_h2 & (score >= 80),
+        ],
+        ["H1", "H2", "H3"],
+        default=""
+    )
+    # Skip dense text blocks (kept only on the title page) and anything below the strict threshold
+    candidates = np.flatnonzero((features["block_density"] <= 5) & (score >= 80) & (levels != ""))
 
-        score = compute_heading_score(line, heading_size_map, body_text_size)
-        if score < 80:  # Strict threshold
+    for i in candidates:
+        text = features["text"][i]
+        page = int(features["page"][i])
+        level = str(levels[i])
+        if headings_per_page[page] > 8:  # Limit headings per page
             continue
 
-        avg_size = sum(span["size"] for span in line["spans"]) / len(line["spans"]) if line["spans"] else 0
-        level = None
-        if (
-            "H1" in heading_size_map and
-            avg_size >= heading_size_map["H1"] * 0.95 and
-            score >= 100
-        ):
-            level = "H1"
-        elif (
-            "H2" in heading_size_map and
-            avg_size >= heading_size_map["H2"] * 0.95 and
-            avg_size < (heading_size_map.get("H1", float('inf')) * 0.95) and
-            score >= 90
-        ):
-            level = "H2"
-        elif (
-            "H3" in heading_size_map and
-            avg_size >= heading_size_map["H3"] * 0.95 and
-            avg_size < (heading_size_map.get("H2", float('inf')) * 0.95) and
-            score >= 80
-        ):
-            level = "H3"
-
-        if level and text != title:  # Avoid duplicating title
-            heading_identifier = (text.lower().strip(), page, level)
+        if text != title:  # Avoid duplicating title
+            heading_identifier = (features["text_key"][i], page, level)
             if heading_identifier not in seen_headings:
-                outline.append({"level": level, "text": text, "page": page, "y0": line["bbox"][1]})
+                outline.append({"level": level, "text": text, "page": page, "y0": float(features["y0"][i])})
                 seen_headings.add(heading_identifier)
                 headings_per_page[page] += 1
 
@@ -293,6 +348,32 @@ def identify_headings(lines, pdf_path):
 
     return {"title": title, "outline": outline}
 
+def _process_one(pdf_file):
+    """Extracts the outline of a single PDF and writes it as JSON to the output directory."""
+    print(f"Processing {pdf_file.name}...")
+    try:
+        with fitz.open(pdf_file) as doc:
+            lines, profile, metadata, page0_height = extract_text_details(doc)
+    except Exception as e:
+        print(f"Error opening {pdf_file.name}: {e}", file=sys.stderr)
+        return
+    if profile is None:
+        print(f"Skipping {pdf_file.name} due to extraction error.", file=sys.stderr)
+        return
+
+    structured_output = identify_headings(lines, profile, metadata, page0_height)
+    output_file = OUTPUT_DIR / f"{pdf_file.stem}.json"
+
+    try:
+        if orjson is not None:
+            output_file.write_bytes(orjson.dumps(structured_output, option=orjson.OPT_INDENT_2))
+        else:
+            with open(output_file, "w", encoding='utf-8') as f:
+                json.dump(structured_output, f, indent=2, ensure_ascii=False)
+        print(f"Generated outline for {pdf_file.name} -> {output_file.name}")
+    except Exception as e:
+        print(f"Error saving JSON for {pdf_file.name}: {e}", file=sys.stderr)
+
 def process_pdfs():
     """Processes all PDFs in the input directory and generates JSON outlines."""
     input_dir = INPUT_DIR
@@ -304,22 +385,9 @@ def process_pdfs():
         print(f"No PDF files found in '{input_dir}'.", file=sys.stderr)
         sys.exit(0)
 
-    for pdf_file in pdf_files:
-        print(f"Processing {pdf_file.name}...")
-        lines = extract_text_details(pdf_file)
-        if not lines:
-            print(f"Skipping {pdf_file.name} due to extraction error.", file=sys.stderr)
-            continue
-
-        structured_output = identify_headings(lines, pdf_file)
-        output_file = output_dir / f"{pdf_file.stem}.json"
-
-        try:
-            with open(output_file, "w", encoding='utf-8') as f:
-                json.dump(structured_output, f, indent=2, ensure_ascii=False)
-            print(f"Generated outline for {pdf_file.name} -> {output_file.name}")
-        except Exception as e:
-            print(f"Error saving JSON for {pdf_file.name}: {e}", file=sys.stderr)
+    # Each PDF is independent; workers inherit the module-level directories via fork
+    with ProcessPoolExecutor(max_workers=min(os.cpu_count() or 1, 4)) as executor:
+        list(executor.map(_process_one, pdf_files, chunksize=1))
 
 if __name__ == "__main__":
     print("Starting PDF processing...")